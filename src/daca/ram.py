@@ -11,6 +11,16 @@ Functions:
     main(argv): Entry point for the command line application to run a RAM
                 program.
 
+Constants:
+    OPCODES: Names of the RAM opcodes, indexed by opcode id.
+    OPCODE_IDS: Mapping from opcode name to opcode id.
+    OP_LOAD, OP_STORE, ..., OP_HALT: Opcode ids of decoded instructions.
+    SUPEROPCODES: Names of the RAM superinstructions, following OPCODES.
+    SUPERINSTRUCTIONS: Mapping from a sequence of opcode ids to the id of the
+                       superinstruction that executes it.
+    HOT_LOOP_THRESHOLD: Number of loop entries before RAM.run compiles a loop.
+    IMMEDIATE, DIRECT, INDIRECT, LABEL: Address modes of decoded instructions.
+
 Exceptions:
     HaltError: Thrown when trying to execute a halted RAM.
     ReadError: Thrown when trying to read past end of input tape.
@@ -19,6 +29,66 @@ Exceptions:
 
 import argparse
 
+OPCODES = (
+    "LOAD",
+    "STORE",
+    "ADD",
+    "SUB",
+    "MULT",
+    "DIV",
+    "READ",
+    "WRITE",
+    "JUMP",
+    "JGTZ",
+    "JZERO",
+    "HALT",
+)
+OPCODE_IDS = {name: op for op, name in enumerate(OPCODES)}
+(
+    OP_LOAD,
+    OP_STORE,
+    OP_ADD,
+    OP_SUB,
+    OP_MULT,
+    OP_DIV,
+    OP_READ,
+    OP_WRITE,
+    OP_JUMP,
+    OP_JGTZ,
+    OP_JZERO,
+    OP_HALT,
+) = range(len(OPCODES))
+
+# Superinstructions execute a common sequence of instructions with a single
+# dispatch. Their ids follow the opcode ids.
+SUPEROPCODES = (
+    "LOAD_ADD_STORE",
+    "LOAD_SUB_STORE",
+    "LOAD_MULT_STORE",
+    "LOAD_JGTZ",
+    "LOAD_JZERO",
+)
+(
+    OP_LOAD_ADD_STORE,
+    OP_LOAD_SUB_STORE,
+    OP_LOAD_MULT_STORE,
+    OP_LOAD_JGTZ,
+    OP_LOAD_JZERO,
+) = range(len(OPCODES), len(OPCODES) + len(SUPEROPCODES))
+SUPERINSTRUCTIONS = {
+    (OP_LOAD, OP_ADD, OP_STORE): OP_LOAD_ADD_STORE,
+    (OP_LOAD, OP_SUB, OP_STORE): OP_LOAD_SUB_STORE,
+    (OP_LOAD, OP_MULT, OP_STORE): OP_LOAD_MULT_STORE,
+    (OP_LOAD, OP_JGTZ): OP_LOAD_JGTZ,
+    (OP_LOAD, OP_JZERO): OP_LOAD_JZERO,
+}
+
+# Number of times RAM.run enters a loop before compiling it to a function.
+HOT_LOOP_THRESHOLD = 50
+
+# Address modes of a decoded instruction operand.
+IMMEDIATE, DIRECT, INDIRECT, LABEL = range(4)
+
 
 class RAM:
     """A random access machine (RAM) models a one-accumulator computer.
@@ -28,53 +98,232 @@ class RAM:
     themselves. Memory is an arbitrarily large sequence of integer registers.
 
     The machine execution methods (LOAD, STORE, ADD, JUMP, etc.) are in all
-    caps and should not be called directly.
+    caps and should not be called directly. Each takes a getter specialized to
+    the address mode of its instruction, chosen once when the program is
+    created, and the decoded address value.
 
-    The run and step methods raise errors if the machine is in a halted state.
+    The step method raises an error if the machine is in a halted state; run
+    does nothing.
 
     Attributes:
         program (Program): RAM program being executed
-        input_tape (list): The input tape for the RAM
+        input_tape (tuple): The read-only input tape for the RAM
         read_head (int): Index of the read head for the input_tape
         output_tape (list): The output tape for the RAM. The write head is
                             always at the end of the tape.
-        registers (dict): Arbitrarily large RAM memory, implemented as a mapping
-                          from register index (int) to register value (int)
+        registers (list): Arbitrarily large RAM memory, implemented as a list
+                          of register values (int) indexed by register number.
+                          The list grows on demand when a register past its
+                          end is set; the registers in between hold 0.
         lc (int): Location counter for next program instruction to execute
         halted (bool): True if the machine is halted or in a bad state
 
     """
 
+    __slots__ = (
+        "program",
+        "input_tape",
+        "read_head",
+        "output_tape",
+        "registers",
+        "lc",
+        "halted",
+    )
+
     def __init__(self, program, input_tape=None):
         """Create a new RAM machine with given program and input tape.
 
         Args:
             program (Program): Program for the machine to run
-            input_tape (list): Input tape for the machine (optional, default
-                               is a blank tape)
+            input_tape (iterable): Input tape for the machine (optional,
+                                   default is a blank tape). It is copied to a
+                                   tuple.
 
         """
         self.program = program
-        self.input_tape = input_tape if input_tape is not None else list()
+        self.reset(input_tape)
+
+    def reset(self, input_tape=None):
+        """Reset the machine to its initial state with a new input tape.
+
+        The registers and output tape are replaced with fresh ones and the
+        location counter and read head return to 0. The program, and all the
+        work cached on it, is kept.
+
+        Args:
+            input_tape (iterable): Input tape for the machine (optional,
+                                   default is a blank tape). It is copied to a
+                                   tuple.
+
+        """
+        self.input_tape = tuple(input_tape) if input_tape is not None else tuple()
         self.read_head = 0
         self.output_tape = list()
-        self.registers = {0: 0}
+        self.registers = [0]
         self.lc = 0
         self.halted = False
 
-    def run(self):
+    def run(self, input_tape=None, compiled=False):
         """Run the machine until reaching a halting state.
 
-        Steps through the next instruction until halting by repeatedly calling
-        the step method.
+        Executes the program's fused instructions (see Program) until halting,
+        so a superinstruction advances the machine over its whole sequence of
+        instructions at once. If an error is raised inside a superinstruction,
+        lc is left at the instruction of the sequence that raised it, as with
+        step.
+
+        The instructions are executed inline rather than through the
+        instruction methods used by step, with the accumulator, location
+        counter and read head held in local variables. The accumulator is
+        written through to register 0 whenever it changes, since register 0
+        may also be read through a direct or indirect address.
+
+        Jumps to the head of a loop (see Program.loops) are counted. Once a
+        loop has been entered HOT_LOOP_THRESHOLD times it is compiled with
+        Program.trace, and from then on the compiled loop runs whenever the
+        loop is entered by a jump.
+
+        Given an input tape, the machine is first reset with it (see reset),
+        so one machine can run its program on many inputs in turn. Otherwise
+        running a halted machine does nothing.
+
+        Args:
+            input_tape (iterable): Input tape to reset the machine with
+                                   (optional, default is to continue from the
+                                   current state)
+            compiled (bool): Run the whole program compiled with
+                             Program.compile instead (optional, default False)
 
         Throws:
-            HaltError if the machine is in a halted state.
             ReadError if attempting to read past the end of the input tape.
 
         """
-        while not self.halted:
-            self.step()
+        if input_tape is not None:
+            self.reset(input_tape)
+        if self.halted:
+            return
+        code = self.program.fused
+        mem = self.registers
+        input_tape = self.input_tape
+        output_tape = self.output_tape
+        write = output_tape.append
+        get = _OPERAND_GETTERS
+        address = _ADDRESS_GETTERS
+
+        program = self.program
+        loops = program.loops
+        entries = dict.fromkeys(loops, 0)
+
+        def call(f, acc, lc, read_head):
+            try:
+                return f(mem, input_tape, output_tape, acc, lc, read_head)
+            except ReadError:
+                self.halted = True
+                raise
+
+        def loop(acc, lc, read_head):
+            if entries[lc] < HOT_LOOP_THRESHOLD:
+                entries[lc] += 1
+                return acc, lc, read_head
+            return call(program.trace(lc), acc, lc, read_head)
+
+        acc = mem[0]
+        lc = self.lc
+        read_head = self.read_head
+        try:
+            if compiled:
+                acc, lc, read_head = call(program.compile(), acc, lc, read_head)
+            while True:
+                op, mode, value = code[lc]
+                if op == OP_LOAD:
+                    acc = mem[0] = get[mode](mem, value)
+                    lc += 1
+                elif op == OP_STORE:
+                    _store(mem, address[mode](mem, value), acc)
+                    lc += 1
+                elif op == OP_ADD:
+                    acc = mem[0] = acc + get[mode](mem, value)
+                    lc += 1
+                elif op == OP_SUB:
+                    acc = mem[0] = acc - get[mode](mem, value)
+                    lc += 1
+                elif op == OP_MULT:
+                    acc = mem[0] = acc * get[mode](mem, value)
+                    lc += 1
+                elif op == OP_DIV:
+                    acc = mem[0] = acc / get[mode](mem, value)
+                    lc += 1
+                elif op == OP_READ:
+                    try:
+                        x = input_tape[read_head]
+                    except IndexError:
+                        self.halted = True
+                        raise ReadError("Tried to read past end of input tape.")
+                    _store(mem, address[mode](mem, value), x)
+                    acc = mem[0]
+                    read_head += 1
+                    lc += 1
+                elif op == OP_WRITE:
+                    write(get[mode](mem, value))
+                    lc += 1
+                elif op == OP_JUMP:
+                    lc = value
+                    if lc in loops:
+                        acc, lc, read_head = loop(acc, lc, read_head)
+                elif op == OP_JGTZ:
+                    lc = value if acc > 0 else lc + 1
+                    if lc in loops:
+                        acc, lc, read_head = loop(acc, lc, read_head)
+                elif op == OP_JZERO:
+                    lc = value if acc == 0 else lc + 1
+                    if lc in loops:
+                        acc, lc, read_head = loop(acc, lc, read_head)
+                elif op == OP_HALT:
+                    self.halted = True
+                    break
+                elif op == OP_LOAD_ADD_STORE:
+                    (ma, a), (mb, b), (mi, i) = value
+                    acc = mem[0] = get[ma](mem, a)
+                    lc += 1
+                    acc = mem[0] = acc + get[mb](mem, b)
+                    lc += 1
+                    _store(mem, address[mi](mem, i), acc)
+                    lc += 1
+                elif op == OP_LOAD_SUB_STORE:
+                    (ma, a), (mb, b), (mi, i) = value
+                    acc = mem[0] = get[ma](mem, a)
+                    lc += 1
+                    acc = mem[0] = acc - get[mb](mem, b)
+                    lc += 1
+                    _store(mem, address[mi](mem, i), acc)
+                    lc += 1
+                elif op == OP_LOAD_MULT_STORE:
+                    (ma, a), (mb, b), (mi, i) = value
+                    acc = mem[0] = get[ma](mem, a)
+                    lc += 1
+                    acc = mem[0] = acc * get[mb](mem, b)
+                    lc += 1
+                    _store(mem, address[mi](mem, i), acc)
+                    lc += 1
+                elif op == OP_LOAD_JGTZ:
+                    (ma, a), (_, b) = value
+                    acc = mem[0] = get[ma](mem, a)
+                    lc = b if acc > 0 else lc + 2
+                    if lc in loops:
+                        acc, lc, read_head = loop(acc, lc, read_head)
+                elif op == OP_LOAD_JZERO:
+                    (ma, a), (_, b) = value
+                    acc = mem[0] = get[ma](mem, a)
+                    lc = b if acc == 0 else lc + 2
+                    if lc in loops:
+                        acc, lc, read_head = loop(acc, lc, read_head)
+        except Exception as error:
+            # Errors raised by compiled code carry where it stopped.
+            lc, read_head = getattr(error, "ram_state", (lc, read_head))
+            raise
+        finally:
+            self.lc = lc
+            self.read_head = read_head
 
     def step(self):
         """Execute the next instruction.
@@ -86,100 +335,92 @@ class RAM:
         """
         if self.halted:
             raise HaltError("Attempt to step program on halted machine state")
-        self.lc = self._dispatch(self.program.instructions[self.lc])
-
-    def _dispatch(self, ins):
-        if ins.opcode == "HALT":
-            return self.HALT()
-        m = getattr(self, ins.opcode)
-        return m(ins.address)
+        handler, get, value = self.program.step_code[self.lc]
+        self.lc = handler(self, get, value)
 
-    def LOAD(self, a):
-        self.set_c(0, self.v(a))
+    def LOAD(self, get, value):
+        self.set_c(0, get(self.registers, value))
         return self.lc + 1
 
-    def STORE(self, i):
-        if i[:1] == "*":
-            self.set_c(self.c(int(i[1:])), self.c(0))
-        else:
-            self.set_c(int(i), self.c(0))
+    def STORE(self, get, value):
+        self.set_c(get(self.registers, value), self.c(0))
         return self.lc + 1
 
-    def ADD(self, a):
-        self.set_c(0, self.c(0) + self.v(a))
+    def ADD(self, get, value):
+        self.set_c(0, self.c(0) + get(self.registers, value))
         return self.lc + 1
 
-    def SUB(self, a):
-        self.set_c(0, self.c(0) - self.v(a))
+    def SUB(self, get, value):
+        self.set_c(0, self.c(0) - get(self.registers, value))
         return self.lc + 1
 
-    def MULT(self, a):
-        self.set_c(0, self.c(0) * self.v(a))
+    def MULT(self, get, value):
+        self.set_c(0, self.c(0) * get(self.registers, value))
         return self.lc + 1
 
-    def DIV(self, a):
-        self.set_c(0, self.c(0) / self.v(a))
+    def DIV(self, get, value):
+        self.set_c(0, self.c(0) / get(self.registers, value))
         return self.lc + 1
 
-    def READ(self, i):
+    def READ(self, get, value):
         try:
-            if i[:1] == "*":
-                self.set_c(self.c(int(i[1:])), self.input_tape[self.read_head])
-            else:
-                self.set_c(int(i), self.input_tape[self.read_head])
+            x = self.input_tape[self.read_head]
         except IndexError:
             self.halted = True
             raise ReadError("Tried to read past end of input tape.")
+        self.set_c(get(self.registers, value), x)
         self.read_head += 1
         return self.lc + 1
 
-    def WRITE(self, a):
-        self.output_tape.append(self.v(a))
+    def WRITE(self, get, value):
+        self.output_tape.append(get(self.registers, value))
         return self.lc + 1
 
-    def JUMP(self, b):
-        return self.program.jumptable[b]
+    def JUMP(self, get, value):
+        return value
 
-    def JGTZ(self, b):
+    def JGTZ(self, get, value):
         if self.c(0) > 0:
-            return self.program.jumptable[b]
+            return value
         else:
             return self.lc + 1
 
-    def JZERO(self, b):
+    def JZERO(self, get, value):
         if self.c(0) == 0:
-            return self.program.jumptable[b]
+            return value
         else:
             return self.lc + 1
 
-    def HALT(self):
+    def HALT(self, get=None, value=None):
         self.halted = True
         return self.lc
 
     def c(self, i):
-        """c(i): Return the value stored at register i."""
+        """c(i): Return the value stored at register i.
+
+        Throws:
+            IndexError if register i has never been reached by set_c.
+
+        """
+        if i < 0:
+            raise IndexError("Invalid register {}".format(i))
         return self.registers[i]
 
     def set_c(self, i, v):
         """c(i) <- v: Set the value at register i to v."""
-        self.registers[i] = v
+        _store(self.registers, i, v)
 
-    def v(self, address):
-        """v(address): Return the value for address.
+    def v(self, mode, value):
+        """v(mode, value): Return the value of a decoded operand.
 
-        Address can be one of:
-            =i Literal value of integer i
-            i  Integer value stored at register i
-            *i Integer value stored at the register number stored in register i
-               (indirect address)
+        Mode can be one of:
+            IMMEDIATE =i Literal value of integer i
+            DIRECT    i  Integer value stored at register i
+            INDIRECT  *i Integer value stored at the register number stored in
+                         register i (indirect address)
 
         """
-        if address[:1] == "=":
-            return int(address[1:])
-        elif address[:1] == "*":
-            return self.c(self.c(int(address[1:])))
-        else:
-            return self.c(int(address))
+        return _OPERAND_GETTERS[mode](self.registers, value)
 
     def ascii_draw(self):
         """Return a representation of the machine's current state as ASCII art."""
@@ -218,9 +459,111 @@ class RAM:
 
 
 class Program:
+    """
+    Representation of a RAM program.
+
+    A program is a list of instructions and a jumptable mapping each label to
+    the index of the instruction it marks. On construction every instruction
+    is decoded into an (opcode id, address mode, value) triple, with jump
+    labels resolved to instruction indices, so the machine never has to
+    inspect address strings while running.
+
+    The decoded instructions are also fused into superinstructions: wherever a
+    sequence listed in SUPERINSTRUCTIONS starts, the fused copy holds a single
+    (superinstruction id, None, operands) triple, where operands are the
+    (mode, value) pairs of the sequence. The following entries are left
+    unfused, so a jump into the middle of a sequence still lands on the
+    original instruction.
+
+    Loops are found from the backward jumps of the program: loops maps the
+    index of each loop head (the target of a backward jump) to the index of
+    the last instruction jumping back to it. The RAM compiles loops that get
+    hot into Python functions with the trace method.
+
+    For stepping, step_code holds a (method, getter, value) triple for each
+    instruction: the unbound RAM instruction method, the operand or register
+    getter for its address mode, and the decoded value. It is shared by every
+    machine running the program.
+
+    """
+
+    __slots__ = (
+        "instructions",
+        "jumptable",
+        "decoded",
+        "fused",
+        "loops",
+        "step_code",
+        "_traces",
+        "_compiled",
+    )
+
     def __init__(self, instructions, jumptable):
         self.instructions = instructions
         self.jumptable = jumptable
+        self.decoded = tuple(ins.decode(jumptable) for ins in instructions)
+        self.fused = self._fuse()
+        self.loops = self._find_loops()
+        self.step_code = tuple(_specialize(*ins) for ins in self.decoded)
+        self._traces = dict()
+        self._compiled = None
+
+    def _fuse(self):
+        decoded = self.decoded
+        fused = list(decoded)
+        for i in range(len(decoded)):
+            for sequence, superop in SUPERINSTRUCTIONS.items():
+                window = decoded[i : i + len(sequence)]
+                if tuple(op for op, _, _ in window) == sequence:
+                    operands = tuple((mode, value) for _, mode, value in window)
+                    fused[i] = (superop, None, operands)
+                    break
+        return tuple(fused)
+
+    def _find_loops(self):
+        loops = dict()
+        for i, (_, mode, value) in enumerate(self.decoded):
+            if mode == LABEL and value <= i:
+                loops[value] = max(i, loops.get(value, i))
+        return loops
+
+    def trace(self, head):
+        """Return the loop starting at instruction head compiled to a function.
+
+        The loop spans the instructions from head to loops[head]. Each basic
+        block of the loop becomes straight-line Python code with its operands
+        inlined, and jumps between blocks become a test of the location counter
+        in a while loop. Compiled loops are cached on the program.
+
+        The function is called as
+        f(registers, input_tape, output_tape, accumulator, lc, read_head) and
+        runs the loop until control leaves it (including on HALT, which is left
+        for the caller to execute), returning the new (accumulator, lc,
+        read_head). If a register the loop stores to directly has not been
+        reached yet, it returns at once without running the loop. An error
+        raised inside the loop is given a ram_state attribute holding
+        (lc, read_head), where lc is the instruction that raised it.
+
+        """
+        try:
+            return self._traces[head]
+        except KeyError:
+            end = self.loops[head]
+            f = self._traces[head] = _compile(self.decoded, head, end, True)
+            return f
+
+    def compile(self):
+        """Return the whole program compiled to a function.
+
+        The program is compiled like a loop (see trace), starting at
+        instruction 0, except that registers are grown on demand rather than
+        guarded on entry. The function runs until the program reaches HALT or
+        an error is raised. The compiled program is cached.
+
+        """
+        if self._compiled is None:
+            self._compiled = _compile(self.decoded, 0, len(self.decoded) - 1, False)
+        return self._compiled
 
     def emit(self):
         left = self._label_column()
@@ -232,7 +575,7 @@ class Program:
         indent = max([0] + [len(k) + len(sep) for k in self.jumptable.keys()])
         prefix = " " * indent
         label_column = [prefix] * len(self.instructions)
-        for label, line in self.jumptable.iteritems():
+        for label, line in self.jumptable.items():
             label_column[line] = (label + sep).ljust(indent)
         return label_column
 
@@ -247,11 +590,64 @@ class Instruction:
     An instruction consists of an opcode and an optional address. An address
     can be an operand or a label.
 
+    The address is parsed once on construction into an address mode and a
+    value: operands become IMMEDIATE, DIRECT or INDIRECT with the integer after
+    any "=" or "*" prefix, and the label of a jump becomes LABEL with the label
+    itself as its value. An instruction without an address has mode and value
+    None.
+
     """
 
+    __slots__ = ("opcode", "address", "mode", "value")
+
     def __init__(self, opcode, address=None):
         self.opcode = opcode
         self.address = address
+        self.mode, self.value = self._parse_address()
+
+    def _parse_address(self):
+        a = self.address
+        if a is None:
+            return None, None
+        opcode = self.opcode
+        prefix = a[:1]
+        if opcode in ("JUMP", "JGTZ", "JZERO"):
+            return LABEL, a
+        elif prefix == "=":
+            if opcode in ("STORE", "READ"):
+                raise ValueError("{} cannot take a literal operand".format(self))
+            return IMMEDIATE, int(a[1:])
+        elif prefix == "*":
+            return INDIRECT, self._parse_register(a[1:])
+        else:
+            return DIRECT, self._parse_register(a)
+
+    def _parse_register(self, a):
+        i = int(a)
+        if i < 0:
+            raise ValueError("{} has an invalid register number".format(self))
+        return i
+
+    def decode(self, jumptable):
+        """Return the instruction as an (opcode id, address mode, value) triple.
+
+        The opcode id is the index of the opcode in OPCODES. A LABEL value is
+        resolved to the index of the instruction it marks in jumptable.
+
+        Throws:
+            ValueError if the opcode is unknown or the label of a jump is not
+            in jumptable.
+
+        """
+        op = OPCODE_IDS.get(self.opcode)
+        if op is None:
+            raise ValueError("Unknown opcode in {}".format(self))
+        if self.mode == LABEL:
+            try:
+                return (op, LABEL, jumptable[self.value])
+            except KeyError:
+                raise ValueError("Undefined label in {}".format(self))
+        return (op, self.mode, self.value)
 
     def __repr__(self):
         return "Instruction({}, {})".format(self.opcode, self.address)
@@ -271,23 +667,191 @@ class ReadError(IndexError):
     """Thrown when trying to read past end of input tape."""
 
 
+def _register(i):
+    if i < 0:
+        raise IndexError("Invalid register {}".format(i))
+    return i
+
+
+def _store(mem, i, x):
+    _register(i)
+    if i >= len(mem):
+        mem.extend([0] * (i + 1 - len(mem)))
+    mem[i] = x
+
+
+def _v_immediate(mem, value):
+    return value
+
+
+def _v_direct(mem, value):
+    return mem[value]
+
+
+def _v_indirect(mem, value):
+    return mem[_register(mem[value])]
+
+
+def _a_direct(mem, value):
+    return value
+
+
+def _a_indirect(mem, value):
+    return _register(mem[value])
+
+
+# Operand getters, indexed by address mode.
+_OPERAND_GETTERS = (_v_immediate, _v_direct, _v_indirect)
+# Getters of the register number addressed by STORE and READ, indexed by
+# address mode.
+_ADDRESS_GETTERS = (None, _a_direct, _a_indirect)
+
+
+# RAM instruction methods, indexed by opcode id.
+_HANDLERS = tuple(getattr(RAM, name) for name in OPCODES)
+
+
+def _specialize(op, mode, value):
+    if mode == LABEL or mode is None:
+        get = None
+    elif op in (OP_STORE, OP_READ):
+        get = _ADDRESS_GETTERS[mode]
+    else:
+        get = _OPERAND_GETTERS[mode]
+    return _HANDLERS[op], get, value
+
+
+def _compile(decoded, start, end, guarded):
+    ret = "return acc, lc, read_head"
+
+    def fetch(mode, value):
+        if mode == IMMEDIATE:
+            return repr(value)
+        elif mode == INDIRECT:
+            return "mem[_register(mem[{}])]".format(value)
+        else:
+            return "mem[{}]".format(value)
+
+    def store(mode, value, x):
+        if mode == INDIRECT:
+            return "_store(mem, mem[{}], {})".format(value, x)
+        elif guarded:
+            return "mem[{}] = {}".format(value, x)
+        else:
+            return "_store(mem, {}, {})".format(value, x)
+
+    def goto(target):
+        if start <= target <= end:
+            return ["lc = {}".format(target), "continue"]
+        else:
+            return ["lc = {}".format(target), ret]
+
+    arithmetic = {OP_ADD: "+", OP_SUB: "-", OP_MULT: "*", OP_DIV: "/"}
+    branches = {OP_JGTZ: "acc > 0", OP_JZERO: "acc == 0"}
+    # Falling off the end leaves the compiled code at instruction end + 1.
+    leaders = {start, end + 1}
+    stored = [0]
+    for i in range(start, end + 1):
+        op, mode, value = decoded[i]
+        if mode == LABEL or op == OP_HALT:
+            leaders.add(i + 1)
+            if mode == LABEL and start <= value <= end:
+                leaders.add(value)
+        elif op in (OP_STORE, OP_READ) and mode == DIRECT:
+            stored.append(value)
+
+    body = []
+    for i in range(start, end + 1):
+        op, mode, value = decoded[i]
+        # Keep lc exact wherever an error can be raised.
+        raises = (
+            op in (OP_READ, OP_DIV)
+            or mode == INDIRECT
+            or (mode == DIRECT and op != OP_STORE)
+        )
+        if i in leaders:
+            body.append("if lc == {}:".format(i))
+        elif raises:
+            body.append("    lc = {}".format(i))
+        if op == OP_LOAD:
+            lines = ["acc = mem[0] = " + fetch(mode, value)]
+        elif op == OP_STORE:
+            lines = [store(mode, value, "acc")]
+        elif op in arithmetic:
+            expr = "acc {} {}".format(arithmetic[op], fetch(mode, value))
+            lines = ["acc = mem[0] = " + expr]
+        elif op == OP_READ:
+            lines = [
+                "try:",
+                "    x = input_tape[read_head]",
+                "except IndexError:",
+                "    raise ReadError('Tried to read past end of input tape.')",
+                store(mode, value, "x"),
+                "acc = mem[0]",
+                "read_head += 1",
+            ]
+        elif op == OP_WRITE:
+            lines = ["write({})".format(fetch(mode, value))]
+        elif op == OP_JUMP:
+            lines = goto(value)
+        elif op in branches:
+            lines = ["if {}:".format(branches[op])]
+            lines += ["    " + line for line in goto(value)]
+        else:
+            lines = ["lc = {}".format(i), ret]
+        body += ["    " + line for line in lines]
+        if i + 1 in leaders and op not in (OP_JUMP, OP_HALT):
+            body.append("    lc = {}".format(i + 1))
+            if i == end:
+                body.append("    " + ret)
+
+    head = [
+        "def run(mem, input_tape, output_tape, acc, lc, read_head):",
+        "    write = output_tape.append",
+    ]
+    if guarded:
+        head += ["    if len(mem) <= {}:".format(max(stored)), "        " + ret]
+    src = "\n".join(
+        head
+        + ["    try:", "        while True:"]
+        + ["            " + line for line in body]
+        # lc starts no block: leave it to the caller.
+        + ["            " + ret]
+        + ["    except Exception as error:"]
+        + ["        error.ram_state = (lc, read_head)", "        raise"]
+    )
+    namespace = {"_register": _register, "_store": _store, "ReadError": ReadError}
+    filename = "<RAM instructions {}-{}>".format(start, end)
+    exec(compile(src, filename, "exec"), namespace)
+    return namespace["run"]
+
+
 def parse(s):
-    index = 0
+    """Parse the RAM program in string s and return an instance of Program.
+
+    Tokens are separated by whitespace. A token ending in ":" labels the next
+    instruction, HALT stands alone, and every other opcode takes the following
+    token as its address.
+
+    Throws:
+        ValueError if the last opcode is missing its address, an opcode is
+        unknown or a jump label is undefined.
+
+    """
     jumptable = dict()
     instructions = list()
-    acc = None
-    for tok in s.split():
-        if acc is None and tok == "HALT":
-            instructions.append(Instruction("HALT"))
-            index += 1
-        elif acc is None and tok[-1] == ":":
-            jumptable[tok[:-1]] = index
-        elif acc is None:
-            acc = tok
+    append = instructions.append
+    tokens = iter(s.split())
+    for tok in tokens:
+        if tok == "HALT":
+            append(Instruction("HALT"))
+        elif tok[-1] == ":":
+            jumptable[tok[:-1]] = len(instructions)
         else:
-            instructions.append(Instruction(acc, tok))
-            acc = None
-            index += 1
+            address = next(tokens, None)
+            if address is None:
+                raise ValueError("Missing address for {}".format(tok))
+            append(Instruction(tok, address))
     return Program(instructions, jumptable)
 
 
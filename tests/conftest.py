@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import pytest
+
+from daca.ram import parse
+
+
+@pytest.fixture(scope="session")
+def n_pow_n_file():
+    return Path(__file__).parent.parent / "examples" / "ch1" / "n_pow_n.ram"
+
+
+@pytest.fixture(scope="session")
+def n_pow_n(n_pow_n_file):
+    return n_pow_n_file.read_text()
+
+
+@pytest.fixture(scope="session")
+def n_pow_n_program(n_pow_n):
+    return parse(n_pow_n)
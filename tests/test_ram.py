@@ -1,12 +1,359 @@
-from pathlib import Path
+import pytest
 
-from daca.ram import RAM, parse
+from daca.ram import (
+    DIRECT,
+    HOT_LOOP_THRESHOLD,
+    IMMEDIATE,
+    INDIRECT,
+    LABEL,
+    OP_ADD,
+    OP_HALT,
+    OP_JGTZ,
+    OP_LOAD,
+    OP_LOAD_SUB_STORE,
+    OP_STORE,
+    RAM,
+    Instruction,
+    ReadError,
+    parse,
+)
 
 
-def test_ram_n_pow_n():
-    p = Path(__file__).parent.parent / "examples" / "ch1" / "n_pow_n.ram"
+def run_by_steps(program, input_tape):
+    ram = RAM(program, input_tape)
+    while not ram.halted:
+        ram.step()
+    return ram
+
+
+def test_ram_n_pow_n(n_pow_n):
     input_tape = [5]
-    program = parse(p.read_text())
+    program = parse(n_pow_n)
     ram = RAM(program, input_tape)
     ram.run()
     assert ram.output_tape == [5**5]
+
+
+def test_ram_run_with_input_tape(n_pow_n_program):
+    ram = RAM(n_pow_n_program)
+    for n in (3, 1, 6):
+        ram.run([n])
+        assert ram.output_tape == [n**n]
+        assert ram.read_head == 1
+    ram.run([4], compiled=True)
+    assert ram.output_tape == [4**4]
+
+
+def test_instruction_decode():
+    jumptable = {"loop": 3}
+    assert Instruction("LOAD", "=7").decode(jumptable) == (OP_LOAD, IMMEDIATE, 7)
+    assert Instruction("ADD", "2").decode(jumptable) == (OP_ADD, DIRECT, 2)
+    assert Instruction("STORE", "*1").decode(jumptable) == (OP_STORE, INDIRECT, 1)
+    assert Instruction("JGTZ", "loop").decode(jumptable) == (OP_JGTZ, LABEL, 3)
+    assert Instruction("HALT").decode(jumptable) == (OP_HALT, None, None)
+
+
+def test_ram_indirect_addressing():
+    program = parse("READ 1 READ *1 LOAD *1 ADD =1 STORE *1 WRITE 3 HALT")
+    ram = RAM(program, [3, 41])
+    ram.run()
+    assert ram.output_tape == [42]
+
+
+def test_ram_registers_grow_on_demand():
+    ram = RAM(parse("HALT"))
+    ram.set_c(3, 9)
+    assert ram.registers == [0, 0, 0, 9]
+    assert ram.c(3) == 9
+    with pytest.raises(IndexError):
+        ram.c(4)
+    with pytest.raises(IndexError):
+        ram.set_c(-1, 0)
+
+
+def test_instruction_parses_address_once():
+    ins = Instruction("SUB", "=1")
+    assert (ins.mode, ins.value) == (IMMEDIATE, 1)
+    jump = Instruction("JUMP", "top")
+    assert (jump.mode, jump.value) == (LABEL, "top")
+    with pytest.raises(ValueError):
+        Instruction("STORE", "=1")
+
+
+def test_program_fuses_superinstructions():
+    program = parse("top: LOAD 1 SUB =1 STORE 1 JGTZ top HALT")
+    assert program.fused[0] == (
+        OP_LOAD_SUB_STORE,
+        None,
+        ((DIRECT, 1), (IMMEDIATE, 1), (DIRECT, 1)),
+    )
+    assert program.fused[1:] == program.decoded[1:]
+
+
+def test_ram_run_jumps_into_superinstruction():
+    program = parse(
+        """
+              READ 1
+              LOAD =10
+              JUMP middle
+              LOAD 1
+        middle: ADD 1
+              STORE 2
+              WRITE 2
+              HALT
+        """
+    )
+    ram = RAM(program, [5])
+    ram.run()
+    assert ram.output_tape == [15]
+
+
+def test_ram_run_superinstruction_reads_register_0():
+    # The LOAD of a fused sequence must reach register 0 before its ADD does.
+    for source in (
+        "READ 1 LOAD 1 ADD 0 STORE 2 WRITE 2 HALT",
+        "READ 1 LOAD =0 STORE 3 LOAD 1 MULT *3 STORE 2 WRITE 2 HALT",
+    ):
+        program = parse(source)
+        ram = RAM(program, [5])
+        ram.run()
+        stepped = run_by_steps(program, [5])
+        assert ram.output_tape == stepped.output_tape
+        assert ram.registers == stepped.registers
+
+
+def test_ram_run_superinstruction_error_lc():
+    for source, lc in (
+        ("LOAD =1 STORE 1 LOAD 1 ADD 5 STORE 2 HALT", 3),
+        ("LOAD =1 STORE 1 LOAD =-3 STORE 3 LOAD 1 ADD =1 STORE *3 HALT", 6),
+    ):
+        program = parse(source)
+        for run in (RAM.step, RAM.run, lambda ram: ram.run(compiled=True)):
+            ram = RAM(program)
+            with pytest.raises(IndexError):
+                while True:
+                    run(ram)
+            assert ram.lc == lc
+
+
+def test_ram_run_matches_step(n_pow_n_program):
+    program = n_pow_n_program
+    stepped = run_by_steps(program, [4])
+    ran = RAM(program, [4])
+    ran.run()
+    assert ran.output_tape == stepped.output_tape == [4**4]
+    assert ran.registers == stepped.registers
+    assert ran.lc == stepped.lc
+
+
+def test_ram_run_accumulator_through_register_0():
+    program = parse("READ 0 STORE 1 LOAD =0 ADD 1 WRITE 0 STORE 2 LOAD *0 WRITE 0 HALT")
+    ram = RAM(program, [2])
+    ram.run()
+    assert ram.output_tape == [2, 2]
+    assert ram.registers == [2, 2, 2]
+
+
+def test_ram_run_read_past_end_of_tape():
+    ram = RAM(parse("READ 1 READ 2 HALT"), [1])
+    with pytest.raises(ReadError):
+        ram.run()
+    assert ram.halted
+    assert ram.lc == 1
+    assert ram.read_head == 1
+
+
+def test_parse_missing_address():
+    with pytest.raises(ValueError):
+        parse("READ 1 WRITE")
+
+
+def test_ram_run_hot_loop_matches_step(n_pow_n_program):
+    program = n_pow_n_program
+    n = 3 * HOT_LOOP_THRESHOLD
+    ram = RAM(program, [n])
+    ram.run()
+    stepped = run_by_steps(program, [n])
+    assert ram.output_tape == stepped.output_tape == [n**n]
+    assert ram.registers == stepped.registers
+    assert ram.lc == stepped.lc
+
+
+def test_ram_run_hot_loop_halt_inside_block():
+    # HALT shares a block with the WRITE before it, so the compiled loop must
+    # leave lc at HALT rather than at the start of the block.
+    program = parse(
+        """
+              READ 1
+        top:  LOAD 1
+              JGTZ cont
+              WRITE =9
+              HALT
+        cont: SUB =1
+              STORE 1
+              JUMP top
+        """
+    )
+    for n in (5, 4 * HOT_LOOP_THRESHOLD):
+        ram = RAM(program, [n])
+        ram.run()
+        stepped = run_by_steps(program, [n])
+        assert ram.output_tape == stepped.output_tape == [9]
+        assert ram.lc == stepped.lc
+
+
+def test_ram_run_hot_loop_indirect_store():
+    # Store the input tape into registers 10, 11, ... until a 0 is read,
+    # then write them back out in reverse.
+    program = parse(
+        """
+              LOAD =10
+              STORE 1
+        read: READ *1
+              LOAD *1
+              JZERO write
+              LOAD 1
+              ADD =1
+              STORE 1
+              JUMP read
+       write: LOAD 1
+              SUB =1
+              STORE 1
+              SUB =9
+              JZERO done
+              WRITE *1
+              JUMP write
+        done: HALT
+        """
+    )
+    tape = list(range(1, 2 * HOT_LOOP_THRESHOLD)) + [0]
+    ram = RAM(program, tape)
+    ram.run()
+    assert ram.output_tape == tape[-2::-1]
+    assert ram.registers == run_by_steps(program, tape).registers
+
+
+def test_ram_run_hot_loop_read_past_end_of_tape():
+    program = parse("loop: READ 1 WRITE 1 JUMP loop")
+    ram = RAM(program, list(range(2 * HOT_LOOP_THRESHOLD)))
+    with pytest.raises(ReadError):
+        ram.run()
+    assert ram.halted
+    assert ram.lc == 0
+    assert ram.read_head == 2 * HOT_LOOP_THRESHOLD
+    assert ram.output_tape == list(range(2 * HOT_LOOP_THRESHOLD))
+
+
+def test_ram_input_tape_is_copied():
+    tape = [1, 2]
+    ram = RAM(parse("READ 1 READ 2 WRITE 2 HALT"), tape)
+    tape.append(3)
+    assert ram.input_tape == (1, 2)
+    ram.run()
+    assert ram.output_tape == [2]
+
+
+def test_ram_run_compiled(n_pow_n_program):
+    program = n_pow_n_program
+    for n in (-1, 0, 7):
+        ram = RAM(program, [n])
+        ram.run(compiled=True)
+        stepped = run_by_steps(program, [n])
+        assert ram.halted
+        assert ram.output_tape == stepped.output_tape
+        assert ram.registers == stepped.registers
+        assert ram.lc == stepped.lc
+
+
+def test_ram_run_compiled_halt_inside_block():
+    for source, input_tape, output_tape in (
+        ("WRITE =1 HALT", [], [1]),
+        ("READ 1 LOAD =3 ADD =4 STORE 2 WRITE 2 HALT", [1], [7]),
+    ):
+        ram = RAM(parse(source), input_tape)
+        ram.run(compiled=True)
+        assert ram.halted
+        assert ram.output_tape == output_tape
+        assert ram.lc == len(ram.program.decoded) - 1
+
+
+def test_ram_run_compiled_without_halt():
+    for source, input_tape, output_tape in (
+        ("WRITE =1 WRITE =2", [], [1, 2]),
+        ("READ 1 WRITE 1", [3], [3]),
+    ):
+        program = parse(source)
+        for run in (RAM.step, RAM.run, lambda ram: ram.run(compiled=True)):
+            ram = RAM(program, input_tape)
+            with pytest.raises(IndexError):
+                while True:
+                    run(ram)
+            assert ram.output_tape == output_tape
+            assert ram.lc == 2
+
+
+def test_ram_run_compiled_after_step():
+    program = parse("READ 1 LOAD 1 ADD =1 STORE 2 WRITE 2 HALT")
+    ram = RAM(program, [1])
+    ram.step()
+    ram.step()
+    ram.run(compiled=True)
+    assert ram.output_tape == [2]
+
+
+def test_ram_run_compiled_error():
+    ram = RAM(parse("READ 1 LOAD *1 WRITE 0 HALT"), [5])
+    with pytest.raises(IndexError):
+        ram.run(compiled=True)
+    assert ram.lc == 1
+    assert ram.read_head == 1
+
+
+def test_ram_run_compiled_read_error_read_head():
+    program = parse("LOAD =-1 STORE 1 READ *1 HALT")
+    for compiled in (False, True):
+        ram = RAM(program, [7])
+        with pytest.raises(IndexError):
+            ram.run(compiled=compiled)
+        assert ram.lc == 2
+        assert ram.read_head == 0
+
+
+def test_ram_read_invalid_register_is_not_read_error():
+    program = parse("READ *1 HALT")
+    runs = (
+        lambda ram: ram.step(),
+        lambda ram: ram.run(),
+        lambda ram: ram.run(compiled=True),
+    )
+    for run in runs:
+        ram = RAM(program, [5])
+        with pytest.raises(IndexError) as excinfo:
+            run(ram)
+        assert not isinstance(excinfo.value, ReadError)
+        assert not ram.halted
+        assert ram.read_head == 0
+
+
+def test_program_emit(n_pow_n_program):
+    program = n_pow_n_program
+    emitted = program.emit()
+    assert emitted.splitlines()[10] == "while:    LOAD 3"
+    assert parse(emitted).decoded == program.decoded
+
+
+def test_parse_undefined_label():
+    with pytest.raises(ValueError):
+        parse("JUMP nowhere HALT")
+
+
+def test_parse_unknown_opcode():
+    with pytest.raises(ValueError):
+        parse("LOAD =1 JUMPZ 1 HALT")
+
+
+def test_ram_step_follows_program():
+    ram = RAM(parse("WRITE =1 HALT"))
+    ram.program = parse("WRITE =2 HALT")
+    ram.step()
+    assert ram.output_tape == [2]